@@ -0,0 +1,147 @@
+import atexit
+import functools
+import json
+import logging
+import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from urllib.parse import urlencode
+from dotenv import load_dotenv
+
+try:
+    import orjson
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _json_dumps = json.dumps
+
+LOG_BUFFER_SIZE = 64 * 1024
+
+class JsonFormatter(logging.Formatter):
+    """Custom JSON formatter for logging."""
+    def format(self, record):
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        log_entry = {
+            "timestamp": f"{timestamp}.{int(record.msecs):03d}",
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno
+        }
+        return _json_dumps(log_entry)
+
+class SizeTrackingRotatingFileHandler(RotatingFileHandler):
+    """Rotating file handler that counts bytes written instead of querying the file per record."""
+    def __init__(self, filename, *args, **kwargs):
+        super().__init__(filename, *args, **kwargs)
+        try:
+            self._bytes_written = os.path.getsize(self.baseFilename)
+        except OSError:
+            self._bytes_written = 0
+        self._pending_line = None
+        self._pending_bytes = 0
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=LOG_BUFFER_SIZE,
+                    encoding=self.encoding, errors=self.errors)
+
+    def shouldRollover(self, record):
+        # The formatted line is kept for emit so each record goes through the formatter once
+        self._pending_line = self.format(record) + self.terminator
+        if self.maxBytes <= 0:
+            return False
+        self._pending_bytes = len(self._pending_line.encode(self.encoding or "utf-8"))
+        return self._bytes_written + self._pending_bytes >= self.maxBytes
+
+    def doRollover(self):
+        super().doRollover()
+        self._bytes_written = 0
+
+    def emit(self, record):
+        # Unlike StreamHandler.emit, skip the per-record flush; the listener flushes once per drained queue
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self._pending_line)
+            self._bytes_written += self._pending_bytes
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+class DrainingQueueListener(QueueListener):
+    """Queue listener that flushes its handlers each time it has drained the queue."""
+    def dequeue(self, block):
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+        return self.queue.get(block)
+
+_log_handler = None
+_DIRS_READY = set()
+
+def ensure_dir(path: str) -> str:
+    """Create a directory once per process, skipping the makedirs syscalls on later calls."""
+    if path not in _DIRS_READY:
+        os.makedirs(path, exist_ok=True)
+        _DIRS_READY.add(path)
+    return path
+
+def setup_logging(name: str) -> logging.Logger:
+    """Attach the process-wide JSON rotating file handler to the named logger.
+
+    Loggers only enqueue records; a background QueueListener thread writes them
+    to the buffered log file and flushes whenever the queue is drained, so disk
+    I/O never runs on the event loop.
+    """
+    global _log_handler
+    if _log_handler is None:
+        log_dir = ensure_dir(os.path.join(os.getcwd(), "logs"))
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        log_file = os.path.join(log_dir, f"{timestamp}.log")
+
+        file_handler = SizeTrackingRotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+
+        log_queue = queue.SimpleQueue()
+        listener = DrainingQueueListener(log_queue, file_handler)
+        listener.start()
+
+        def stop_listener():
+            listener.stop()
+            file_handler.flush()
+
+        atexit.register(stop_listener)
+        _log_handler = QueueHandler(log_queue)
+
+    logger = logging.getLogger(name)
+    if _log_handler not in logger.handlers:
+        logger.setLevel(logging.INFO)
+        logger.addHandler(_log_handler)
+    return logger
+
+def load_env() -> None:
+    """Load variables from .env unless running under the Coral orchestration runtime."""
+    if os.getenv("CORAL_ORCHESTRATION_RUNTIME") is None:
+        load_dotenv()
+
+@functools.lru_cache(maxsize=4)
+def build_coral_url(base_url: str, agent_id: str, agent_description: str) -> str:
+    """Build the Coral server SSE URL carrying the agent's id and description."""
+    query_string = urlencode({
+        "agentId": agent_id,
+        "agentDescription": agent_description
+    })
+    return f"{base_url}?{query_string}"
+
+def event_loop_factory():
+    """Return uvloop's loop factory for asyncio.run, or None to use the default loop."""
+    try:
+        import uvloop
+    except ImportError:
+        return None  # uvloop is unavailable on Windows; fall back to the default loop
+    return uvloop.new_event_loop
@@ -3,7 +3,7 @@ import logging
 import json
 import xml.etree.ElementTree as ET
 from typing import List, Dict, Any
-from dotenv import load_dotenv
+from utils.bootstrap import load_env
 
 
 logging.basicConfig(
@@ -13,9 +13,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 def load_config() -> Dict[str, Any]:
-    runtime = os.getenv("CORAL_ORCHESTRATION_RUNTIME", None)
-    if runtime is None:
-        load_dotenv()
+    load_env()
     
     config = {
         "runtime": os.getenv("CORAL_ORCHESTRATION_RUNTIME", None),
@@ -56,6 +54,8 @@ def parse_mentions_response(response: str) -> List[Dict[str, str]]:
         if not response or not isinstance(response, str):
             logger.info("Empty or non-string mentions response")
             return []
+        if "ResolvedMessage" not in response:
+            return []
         
         root = ET.fromstring(response)
         messages = []
@@ -1,18 +1,10 @@
 import asyncio
-import json
+import functools
 import logging
 import os
-from contextlib import AsyncExitStack
-from datetime import datetime
-from logging.handlers import RotatingFileHandler
-from urllib.parse import urlencode
-from dotenv import load_dotenv
-from langchain.agents import create_tool_calling_agent, AgentExecutor
-from langchain_mcp_adapters.client import MultiServerMCPClient
-from langchain.chat_models import init_chat_model
-from langchain.prompts import ChatPromptTemplate
-from utils.coral_config import load_config, get_tools_description, parse_mentions_response, mcp_resources_details
-
+import traceback
+from utils.bootstrap import setup_logging, load_env, build_coral_url, ensure_dir, event_loop_factory
+from utils.coral_config import load_config, get_tools_description, parse_mentions_response
 
 REQUEST_QUESTION_TOOL = "request-question"
 ANSWER_QUESTION_TOOL = "answer-question"
@@ -22,63 +14,49 @@ DEFAULT_TEMPERATURE = 0.0
 DEFAULT_MAX_TOKENS = 8000
 SLEEP_INTERVAL = 1
 ERROR_RETRY_INTERVAL = 5
+MAX_MENTIONS_TIMEOUT_MS = 120000
+MENTIONS_TIMEOUT_FRACTION = 0.8
+NO_MESSAGES_PREFIX = "No new messages"
 
-class JsonFormatter(logging.Formatter):
-    """Custom JSON formatter for logging."""
-    def format(self, record):
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "level": record.levelname,
-            "message": record.getMessage(),
-            "module": record.module,
-            "line": record.lineno
-        }
-        return json.dumps(log_entry)
-
-def setup_logging():
-    """Configure logging with JSON formatting and rotating file handler."""
-    log_dir = os.path.join(os.getcwd(), "logs")
-    os.makedirs(log_dir, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file = os.path.join(log_dir, f"{timestamp}.log")
-
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.INFO)
-    handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5)
-    handler.setFormatter(JsonFormatter())
-    logger.addHandler(handler)
-    return logger
+_NO_MESSAGES = object()
+AGENT_DESCRIPTION = "Web agent for web browsing and surfing"
+
+@functools.lru_cache(maxsize=1)
+def _sse_read_timeout() -> float:
+    """Return the Coral SSE timeout in seconds, read once after .env is loaded.
+
+    Despite its name, TIMEOUT_MS is read as seconds.
+    """
+    return float(os.getenv("TIMEOUT_MS", 300))
+
+@functools.lru_cache(maxsize=1)
+def _mentions_timeout_ms() -> int:
+    """Return the wait_for_mentions long-poll timeout, kept below the SSE read timeout."""
+    return min(MAX_MENTIONS_TIMEOUT_MS, int(_sse_read_timeout() * 1000 * MENTIONS_TIMEOUT_FRACTION))
 
 async def initialize_agent():
     """Initialize the web agent and return necessary components."""
-    logger = setup_logging()
-    current_dir = os.getcwd()
-    images_dir = os.path.join(current_dir, "images")
-    os.makedirs(images_dir, exist_ok=True)
+    logger = setup_logging(__name__)
+    ensure_dir(os.path.join(os.getcwd(), "images"))
 
     # Load environment variables
-    runtime = os.getenv("CORAL_ORCHESTRATION_RUNTIME")
-    if runtime is None:
-        load_dotenv()
+    load_env()
 
     # Retrieve configuration
     base_url = os.getenv("CORAL_SSE_URL")
     agent_id = os.getenv("CORAL_AGENT_ID")
 
-    if not all([base_url, agent_id]):
+    if not (base_url and agent_id):
         logger.error("Missing required environment variables")
         raise ValueError("CORAL_SSE_URL and CORAL_AGENT_ID must be set")
 
     # Construct server URL
-    coral_params = {
-        "agentId": agent_id,
-        "agentDescription": "Web agent for web browsing and surfing"
-    }
-    query_string = urlencode(coral_params)
-    coral_server_url = f"{base_url}?{query_string}"
-    logger.info(f"Connecting to Coral Server: {coral_server_url}")
-
-    timeout = os.getenv("TIMEOUT_MS", 300)
+    coral_server_url = build_coral_url(base_url, agent_id, AGENT_DESCRIPTION)
+    logger.info("Connecting to Coral Server: %s", coral_server_url)
+
+    from langchain_mcp_adapters.client import MultiServerMCPClient
+
+    timeout = _sse_read_timeout()
     client = MultiServerMCPClient(
         connections={
             "coral": {
@@ -94,33 +72,42 @@ async def initialize_agent():
 
     return logger, client, agent_tools
 
-async def wait_for_mentions(logger, client, agent_tools):
-    """Wait for and process mentions from the Coral server."""
-    logger.info("***********************Waiting for Mentions***********************")
-    resources = await client.get_resources(server_name="coral")
-    coral_resources = mcp_resources_details(resources)
-    mentions_response = await agent_tools['wait_for_mentions'].ainvoke({
-        "timeoutMs": 30000
+async def _poll_mentions(wait_tool, timeout_ms):
+    """Invoke the bound wait_for_mentions tool, returning the _NO_MESSAGES sentinel when the server reports none."""
+    mentions_response = await wait_tool({
+        "timeoutMs": timeout_ms
     })
-    logger.info(f"Received mentions response: {mentions_response}")
+    if isinstance(mentions_response, str) and mentions_response.startswith(NO_MESSAGES_PREFIX):
+        return _NO_MESSAGES
+    return mentions_response
 
-    if isinstance(mentions_response, str) and "No new messages" in mentions_response:
-        await asyncio.sleep(SLEEP_INTERVAL)
+async def _next_mention(logger, wait_tool, send_tool, timeout_ms):
+    """Long-poll once with pre-bound tool callables; return (thread_id, sender_id, content) or None.
+
+    Only a timed-out long poll returns immediately; any other response without a
+    usable mention sleeps SLEEP_INTERVAL so a fast-failing server is not hammered.
+    """
+    logger.info("***********************Waiting for Mentions***********************")
+    mentions_response = await _poll_mentions(wait_tool, timeout_ms)
+    if mentions_response is _NO_MESSAGES:
+        logger.info("No new mentions")
         return None
+    logger.info("Received mentions response: %s", mentions_response)
 
     messages = parse_mentions_response(mentions_response)
-    if not messages or not messages[0].get('threadId'):
+    if not messages:
         await asyncio.sleep(SLEEP_INTERVAL)
         return None
 
-    message = messages[0]
-    thread_id = message.get('threadId')
-    sender_id = message.get('senderId')
-    content = message.get('content')
+    get = messages[0].get
+    thread_id, sender_id, content = get('threadId'), get('senderId'), get('content')
+    if not thread_id:
+        await asyncio.sleep(SLEEP_INTERVAL)
+        return None
 
-    if not all([thread_id, sender_id, content]):
-        logger.warning(f"Missing message fields: thread_id={thread_id}, sender_id={sender_id}")
-        await agent_tools['send_message'].ainvoke({
+    if not (thread_id and sender_id and content):
+        logger.warning("Missing message fields: thread_id=%s, sender_id=%s", thread_id, sender_id)
+        await send_tool({
             "threadId": thread_id,
             "content": "Error: Missing message fields",
             "mentions": [sender_id]
@@ -129,42 +116,61 @@ async def wait_for_mentions(logger, client, agent_tools):
         return None
 
     input_query = content
-    logger.info(f"Content: {input_query}")
+    logger.info("Content: %s", input_query)
     return thread_id, sender_id, input_query
 
+async def wait_for_mentions(logger, agent_tools):
+    """Long-poll the Coral server once; return (thread_id, sender_id, content) or None if no mention arrived."""
+    return await _next_mention(
+        logger,
+        agent_tools['wait_for_mentions'].ainvoke,
+        agent_tools['send_message'].ainvoke,
+        _mentions_timeout_ms()
+    )
+
+async def mentions_stream(logger, agent_tools):
+    """Yield (thread_id, sender_id, content) for each mention, or None after a poll that produced none.
+
+    The None items let callers tell a healthy idle stream from a failing one.
+    """
+    wait_tool = agent_tools['wait_for_mentions'].ainvoke
+    send_tool = agent_tools['send_message'].ainvoke
+    timeout_ms = _mentions_timeout_ms()
+    while True:
+        yield await _next_mention(logger, wait_tool, send_tool, timeout_ms)
+
 async def process_and_respond(logger, agent_tools, browser_result, thread_id, sender_id):
     """Process browser result and send response."""
-    logger.info(f"browser_result: {browser_result}")
-    answer = str(browser_result)
-    logger.info(f"Final answer: {answer}")
+    logger.info("browser_result: %s", browser_result)
+    answer = browser_result if isinstance(browser_result, str) else str(browser_result)
+    logger.info("Final answer: %s", answer)
     await agent_tools['send_message'].ainvoke({
         "threadId": thread_id,
         "content": answer,
         "mentions": [sender_id]
     })
-    logger.info(f"Sent response to thread_id={thread_id}, sender_id={sender_id}, content: {answer}")
-    await asyncio.sleep(SLEEP_INTERVAL)
+    logger.info("Sent response to thread_id=%s, sender_id=%s, content: %s", thread_id, sender_id, answer)
 
 async def example_usage():
     """Example usage of the web agent functions."""
-    async with AsyncExitStack():
-        try:
-            # Initialize the agent
-            logger, client, agent_tools = await initialize_agent()
+    logger = setup_logging(__name__)
+    try:
+        # Initialize the agent
+        logger, client, agent_tools = await initialize_agent()
 
-            # Wait for mentions
-            result = await wait_for_mentions(logger, client, agent_tools)
-            if result:
-                thread_id, sender_id, input_query = result
+        # Wait for mentions
+        result = await wait_for_mentions(logger, agent_tools)
+        if result:
+            thread_id, sender_id, input_query = result
 
-                browser_result = "hello!!!"
+            browser_result = "hello!!!"
 
-                await process_and_respond(logger, agent_tools, browser_result, thread_id, sender_id)
+            await process_and_respond(logger, agent_tools, browser_result, thread_id, sender_id)
 
-        except Exception as e:
-            logger.error(f"Error in example usage: {str(e)}")
-            import traceback
-            logger.debug(f"Traceback: {traceback.format_exc()}")
+    except Exception as e:
+        logger.error("Error in example usage: %s", e)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Traceback: %s", traceback.format_exc())
 
 if __name__ == "__main__":
-    asyncio.run(example_usage())
\ No newline at end of file
+    asyncio.run(example_usage(), loop_factory=event_loop_factory())
\ No newline at end of file
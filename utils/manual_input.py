@@ -1,17 +1,20 @@
+import asyncio
 import logging
 
-def get_user_input(logger: logging.Logger) -> tuple[str | None, bool]:
+INPUT_PROMPT = "Input (type 'exit' to quit): "
+
+def _parse_user_input(raw_input: str, logger: logging.Logger) -> tuple[str | None, bool]:
     """
-    Handle user input with exit condition check.
-    
+    Interpret a line of user input, checking for the exit condition.
+
     Args:
+        raw_input: Line read from stdin
         logger: Logger instance for logging input events
-    
+
     Returns:
-        tuple: (input_query, should_exit) where input_query is the user's input
-               or None if empty, and should_exit is True if user wants to exit
+        tuple: (input_query, should_exit) as described in get_user_input
     """
-    input_query = input("Input (type 'exit' to quit): ").strip()
+    input_query = raw_input.strip()
     if not input_query:
         logger.info("Empty input, skipping...")
         return None, False
@@ -19,4 +22,27 @@ def get_user_input(logger: logging.Logger) -> tuple[str | None, bool]:
         return None, True
     return input_query, False
 
+def get_user_input(logger: logging.Logger) -> tuple[str | None, bool]:
+    """
+    Handle user input with exit condition check.
+
+    Args:
+        logger: Logger instance for logging input events
 
+    Returns:
+        tuple: (input_query, should_exit) where input_query is the user's input
+               or None if empty, and should_exit is True if user wants to exit
+    """
+    return _parse_user_input(input(INPUT_PROMPT), logger)
+
+async def get_user_input_async(logger: logging.Logger) -> tuple[str | None, bool]:
+    """
+    Async variant of get_user_input that reads stdin in a worker thread.
+
+    Args:
+        logger: Logger instance for logging input events
+
+    Returns:
+        tuple: (input_query, should_exit) as returned by get_user_input
+    """
+    return _parse_user_input(await asyncio.to_thread(input, INPUT_PROMPT), logger)